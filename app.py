@@ -1,10 +1,15 @@
 # app.py
 import streamlit as st
-import requests, time
-from datetime import datetime, timedelta
-from math import isfinite
+import threading, time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from upstream import (FETCH_BUDGET_SECONDS, RateLimited, make_session, get_json,
+                      parse_yahoo_quotes, parse_metals, parse_exchangerate)
+import rates
 
-GRAMS_PER_TROY_OUNCE = 31.1034768
+MAX_CACHE_TTL_SECONDS = 3600  # upper bound for the sidebar Cache TTL
+FX_CACHE_TTL_SECONDS = 600  # exchangerate.host updates at most hourly
+HEDGE_DELAY_SECONDS = 0.5  # head start Yahoo gets before Metals-API is also tried
+FAILURE_BACKOFF_SECONDS = 30  # how long a failing source is left alone (429s use at least this)
 
 st.set_page_config(page_title="Gold Rate Calculator — Live (robust)", layout="centered")
 st.title("Gold Rate Calculator — Live (robust)")
@@ -14,206 +19,218 @@ st.sidebar.header("Settings & fallback")
 import_duty_pct = st.sidebar.number_input("Import Duty (%)", value=10.75, step=0.1)
 gst_pct = st.sidebar.number_input("GST (%)", value=3.0, step=0.1)
 round_to = st.sidebar.number_input("Round to (₹)", value=1.0, step=0.1)
-cache_ttl_seconds = st.sidebar.number_input("Cache TTL (sec)", value=120, min_value=10, step=10)
-ui_cooldown = st.sidebar.number_input("UI cooldown (sec)", value=10, min_value=1, step=1)
+cache_ttl_seconds = st.sidebar.number_input("Cache TTL (sec)", value=120, min_value=10, max_value=MAX_CACHE_TTL_SECONDS, step=10)
+ui_cooldown = st.sidebar.number_input("UI cooldown (sec)", value=10, min_value=1, max_value=300, step=1)
 metals_api_key = st.sidebar.text_input("Metals-API key (optional fallback)")
 
 # Buttons
 refresh = st.button("Refresh / Force fetch (respects cooldown)")
 
 # session defaults
-if "cache" not in st.session_state:
-    st.session_state.cache = {}  # keys: xau_usd, usd_inr, fetched_at, source_xau, source_fx
 if "last_user_fetch" not in st.session_state:
     st.session_state.last_user_fetch = None
-if "last_retry_after" not in st.session_state:
-    st.session_state.last_retry_after = None
-
-# helpers
-def cache_set(xau_usd=None, usd_inr=None, source_xau=None, source_fx=None):
-    now = datetime.utcnow()
-    st.session_state.cache.update({
-        "xau_usd": xau_usd,
-        "usd_inr": usd_inr,
-        "fetched_at": now,
-        "source_xau": source_xau,
-        "source_fx": source_fx
-    })
-
-def cache_get():
-    c = st.session_state.cache
-    if not c or "fetched_at" not in c:
-        return None
-    age = (datetime.utcnow() - c["fetched_at"]).total_seconds()
-    if age > cache_ttl_seconds:
-        return None
-    return c
-
-def cache_age_seconds():
-    c = st.session_state.cache
-    if not c or "fetched_at" not in c:
-        return None
-    return (datetime.utcnow() - c["fetched_at"]).total_seconds()
-
-def round_value(x):
-    if round_to <= 0:
-        return round(x, 2)
-    return round(round(x / round_to) * round_to, 2)
-
-# http helper with limited retries and 429 handling (does not block UI)
-def http_get(url, params=None, headers=None, attempts=3):
-    backoff = 1.0
-    last_retry_after = None
-    for attempt in range(1, attempts+1):
-        try:
-            resp = requests.get(url, params=params, headers=headers, timeout=8)
-            if resp.status_code == 429:
-                # read Retry-After if present
-                ra = resp.headers.get("Retry-After")
-                try:
-                    if ra is not None:
-                        last_retry_after = int(float(ra))
-                except Exception:
-                    # ignore parse errors
-                    last_retry_after = None
-                raise requests.exceptions.HTTPError(f"429")
-            resp.raise_for_status()
-            return resp, None
-        except requests.exceptions.HTTPError as he:
-            if "429" in str(he):
-                # bubble up a retry-after hint
-                return None, last_retry_after or int(backoff)
-            if attempt == attempts:
-                raise
-        except Exception:
-            if attempt == attempts:
-                raise
-        time.sleep(backoff)
-        backoff *= 2
-    raise RuntimeError("Unreachable")
-
-# Primary fetchers
-def fetch_xau_yahoo():
+
+# pure arithmetic (rates.py), cached on its inputs: reruns triggered by
+# unrelated widgets reuse the rows instead of recomputing them
+@st.cache_data(max_entries=64, show_spinner=False)
+def compute_rates(xau_usd, usd_inr, import_duty_pct, gst_pct, round_to):
+    return rates.compute_rates(xau_usd, usd_inr, import_duty_pct, gst_pct, round_to)
+
+# one pooled session per process (the script body reruns on every interaction)
+@st.cache_resource
+def get_session():
+    return make_session()
+
+SESSION = get_session()
+
+# Process-wide fetch state shared by every session: the last good result, shown
+# while upstream is failing, and per source the monotonic time before which it
+# must not be called again. Without the latter every rerun in every session would
+# re-hit a source that just answered 429, since failures are never cached.
+# Blocks are per source so a rate-limited Yahoo still leaves Metals-API open.
+# generation is part of every fetcher's cache key; a successful Refresh bumps it
+# so all sessions move to the new values together.
+@st.cache_resource
+def get_shared_state():
+    return {"lock": threading.Lock(), "last_good": None, "blocked_until": {}, "generation": 0}
+
+shared = get_shared_state()
+
+def back_off(source, seconds):
+    with shared["lock"]:
+        until = shared["blocked_until"].get(source, 0.0)
+        shared["blocked_until"][source] = max(until, time.monotonic() + seconds)
+
+def blocked_for(source):
+    return shared["blocked_until"].get(source, 0.0) - time.monotonic()
+
+# Call one source's fetcher and record its failure against that source. Runs in
+# the hedging worker too, so a 429 from the loser of the race is still recorded.
+def call_source(source, fetcher, *args):
+    try:
+        return fetcher(*args)
+    except RateLimited as e:
+        back_off(source, max(e.retry_after, FAILURE_BACKOFF_SECONDS))
+        raise
+    except Exception:
+        back_off(source, FAILURE_BACKOFF_SECONDS)
+        raise
+
+# Fetchers. st.cache_data is process-wide, so one upstream hit per TTL is
+# shared by every session/tab. fetched_at comes from time.monotonic();
+# failures raise, so a 429 is never cached.
+
+# XAU sources ask for USD→INR in the same request and return
+# (xau_usd, usd_inr or None, source, fetched_at). The user-chosen TTL is
+# applied through `bucket` (see ttl_bucket) so the decorator stays fixed:
+# a per-session TTL in the decorator would rebuild the shared cache whenever
+# two viewers used different settings.
+@st.cache_data(ttl=MAX_CACHE_TTL_SECONDS, max_entries=16, show_spinner=False)
+def fetch_xau_yahoo(bucket, xau_symbol="XAUUSD=X", fx_symbol="INR=X"):
     url = "https://query1.finance.yahoo.com/v7/finance/quote"
-    params = {"symbols": "XAUUSD=X"}
-    resp, retry_after = http_get(url, params=params, attempts=2)
-    if resp is None:
-        # return None and retry_after hint
-        return None, None, retry_after
-    j = resp.json()
-    price = j["quoteResponse"]["result"][0]["regularMarketPrice"]
-    return float(price), "Yahoo Finance", None
-
-def fetch_usd_inr():
-    url = "https://api.exchangerate.host/latest"
-    params = {"base": "USD", "symbols": "INR"}
-    resp, retry_after = http_get(url, params=params, attempts=2)
-    if resp is None:
-        return None, None, retry_after
-    j = resp.json()
-    rate = j["rates"]["INR"]
-    return float(rate), "exchangerate.host", None
-
-def fetch_metals_api(key):
+    j = get_json(SESSION, url, {"symbols": f"{xau_symbol},{fx_symbol}"})
+    price, rate = parse_yahoo_quotes(j, xau_symbol, fx_symbol)
+    return price, rate, "Yahoo Finance", time.monotonic()
+
+@st.cache_data(ttl=MAX_CACHE_TTL_SECONDS, max_entries=16, show_spinner=False)
+def fetch_metals_api(key, bucket, symbol="XAU", fx_symbol="INR"):
     url = "https://metals-api.com/api/latest"
-    params = {"access_key": key, "base": "USD", "symbols": "XAU"}
-    resp, retry_after = http_get(url, params=params, attempts=2)
-    if resp is None:
-        return None, None, retry_after
-    j = resp.json()
-    rates = j.get("rates") or {}
-    if "XAU" in rates:
-        r = rates["XAU"]
-        usd_per_xau = 1.0 / float(r) if float(r) != 0 else None
-        return usd_per_xau, "Metals-API", None
-    raise RuntimeError("Metals-API returned unexpected shape")
-
-# Main logic: show cached always (if exists)
-cached = cache_get()
-if cached:
-    age = cache_age_seconds()
-    st.info(f"Showing cached price (age {int(age)}s). Increase Cache TTL in sidebar to keep it longer.")
-    st.write(f"XAU source: **{cached.get('source_xau')}**  |  USD→INR source: **{cached.get('source_fx')}**")
-    st.write(f"XAU (USD/oz): {cached.get('xau_usd')}")
-    st.write(f"USD → INR: {cached.get('usd_inr')}")
-    # show computed rates
-    xau_usd = cached.get('xau_usd')
-    usd_inr = cached.get('usd_inr')
-    usd_per_gram = xau_usd / GRAMS_PER_TROY_OUNCE
-    usd_per_10g = usd_per_gram * 10
-    inr_per_10g = usd_per_10g * usd_inr
-    def show_rates(inr_10g):
-        st.subheader("Final Gold Rates per 10g")
-        for purity, factor in [("24K", 1.0), ("22K", 22/24), ("18K", 18/24)]:
-            base = inr_10g * factor
-            after_imp = base * (1 + import_duty_pct/100)
-            after_gst = after_imp * (1 + gst_pct/100)
-            st.write(f"**{purity}** — Base: ₹ {round_value(base):,}  | After import: ₹ {round_value(after_imp):,}  | Final: ₹ {round_value(after_gst):,}")
-    show_rates(inr_per_10g)
-else:
-    st.warning("No cached rate available yet. Press Refresh to fetch live rate (respecting cooldown).")
+    params = {"access_key": key, "base": "USD", "symbols": f"{symbol},{fx_symbol}"}
+    j = get_json(SESSION, url, params)
+    price, rate = parse_metals(j, symbol, fx_symbol)
+    return price, rate, "Metals-API", time.monotonic()
+
+# USD→INR on its own, for when the XAU source did not return it:
+# (usd_inr, source, fetched_at). Slow-moving, so it keeps its own longer TTL;
+# generation only changes on Refresh.
+@st.cache_data(ttl=FX_CACHE_TTL_SECONDS, max_entries=16, show_spinner=False)
+def fetch_usd_inr(generation, base="USD", symbol="INR"):
+    url = "https://api.exchangerate.host/latest"
+    j = get_json(SESSION, url, {"base": base, "symbols": symbol})
+    rate = parse_exchangerate(j, base, symbol)
+    return rate, "exchangerate.host", time.monotonic()
+
+# changes once every ttl seconds; part of the cache key of the XAU fetchers
+# (together with the Refresh generation).
+# ttl is included so windows of different lengths never share a key.
+def ttl_bucket(ttl):
+    return ttl, int(time.monotonic() // ttl)
+
+# Race Yahoo against Metals-API. The fallback only starts once Yahoo has had
+# HEDGE_DELAY_SECONDS to answer, so it costs nothing on a healthy day but a
+# 429/slow Yahoo no longer delays the fallback until all its retries are spent.
+# A source that is backing off is skipped; with only one source left (or no
+# key) it is called directly, without the worker threads.
+def fetch_xau(key, bucket):
+    if blocked_for("Yahoo Finance") > 0:
+        return call_source("Metals-API", fetch_metals_api, key, bucket)
+    if not key or blocked_for("Metals-API") > 0:
+        return call_source("Yahoo Finance", fetch_xau_yahoo, bucket)
+    ex = ThreadPoolExecutor(max_workers=2)
+    try:
+        primary = ex.submit(call_source, "Yahoo Finance", fetch_xau_yahoo, bucket)
+        done, _ = wait([primary], timeout=HEDGE_DELAY_SECONDS)
+        if done and primary.exception() is None:
+            return primary.result()
+        pending = {primary, ex.submit(call_source, "Metals-API", fetch_metals_api, key, bucket)}
+        errors = []
+        while pending:
+            done, pending = wait(pending, timeout=FETCH_BUDGET_SECONDS, return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError("XAU sources did not respond in time")
+            for f in done:
+                if f.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    return f.result()
+                errors.append(f.exception())
+        # both failed: prefer the 429 hint over a generic error
+        raise next((e for e in errors if isinstance(e, RateLimited)), errors[-1])
+    finally:
+        # don't block the rerun on a hedged request that lost the race
+        ex.shutdown(wait=False)
+
+def show_rates(rows):
+    st.subheader("Final Gold Rates per 10g")
+    # one element for all purities instead of one per row
+    st.markdown("\n\n".join(
+        f"**{purity}** — Base: ₹ {base:,}  | After import: ₹ {after_imp:,}  | Final: ₹ {after_gst:,}"
+        for purity, base, after_imp, after_gst in rows
+    ))
 
 # Determine if user can fetch (UI cooldown)
 if st.session_state.last_user_fetch is None:
     allowed = True
 else:
-    elapsed = (datetime.utcnow() - st.session_state.last_user_fetch).total_seconds()
+    elapsed = time.monotonic() - st.session_state.last_user_fetch
     allowed = elapsed >= ui_cooldown
     if not allowed:
         st.write(f"UI cooldown active — wait {int(ui_cooldown - elapsed)}s before forcing another fetch.")
 
-# If user pressed refresh and allowed, attempt fetch sequence
+# Refresh fetches under the next generation's cache keys. The current values
+# stay cached for everyone and are only replaced if that fetch succeeds.
+force = False
 if refresh:
     if not allowed:
         st.warning("Please wait for cooldown before forcing another fetch.")
     else:
-        st.session_state.last_user_fetch = datetime.utcnow()
-        # attempt primary
-        with st.spinner("Fetching XAU and FX (Yahoo + exchangerate.host)..."):
-            try:
-                xau_res = fetch_xau_yahoo()
-                if xau_res[0] is None:
-                    # got a retry-after
-                    _, _, retry_after = xau_res
-                    st.session_state.last_retry_after = retry_after
-                    st.error(f"Primary source error: 429. Retry after {retry_after}s. Using cached if available.")
-                else:
-                    xau_usd, src_xau, _ = xau_res
-                    fx_res = fetch_usd_inr()
-                    if fx_res[0] is None:
-                        _, _, retry_after = fx_res
-                        st.session_state.last_retry_after = retry_after
-                        st.error(f"Primary FX source error: 429. Retry after {retry_after}s. Using cached if available.")
-                    else:
-                        usd_inr, src_fx, _ = fx_res
-                        # success — cache and show
-                        cache_set(xau_usd=xau_usd, usd_inr=usd_inr, source_xau=src_xau, source_fx=src_fx)
-                        st.success("Fetched live prices and updated cache.")
-                        st.experimental_rerun()
-            except Exception as e:
-                st.error(f"Primary fetch failed: {e}")
-                # try fallback if key present
-                if metals_api_key:
-                    with st.spinner("Trying Metals-API fallback..."):
-                        try:
-                            met = fetch_metals_api(metals_api_key)
-                            if met[0] is None:
-                                _, _, retry_after = met
-                                st.error(f"Fallback 429. Retry after {retry_after}s")
-                            else:
-                                xau_usd, src = met[0], met[1]
-                                fx_res = fetch_usd_inr()
-                                if fx_res[0] is None:
-                                    st.error("FX fetch failed when fallback used.")
-                                else:
-                                    usd_inr, src_fx, _ = fx_res
-                                    cache_set(xau_usd=xau_usd, usd_inr=usd_inr, source_xau=src, source_fx=src_fx)
-                                    st.success("Fallback succeeded and cache updated.")
-                                    st.experimental_rerun()
-                        except Exception as ef:
-                            st.error(f"Fallback attempt failed: {ef}")
-                else:
-                    st.info("No Metals-API key configured. Add one in the sidebar to enable a paid fallback.")
+        st.session_state.last_user_fetch = time.monotonic()
+        force = True
+
+# Main logic: served from the shared cache, upstream only once per TTL
+result = None
+wait_for = blocked_for("Yahoo Finance")
+if metals_api_key:
+    # a 429 seen without a key never blocks the paid fallback
+    wait_for = min(wait_for, blocked_for("Metals-API"))
+if wait_for > 0:
+    st.warning(f"Upstream asked us to back off — next fetch in {int(wait_for) + 1}s.")
+else:
+    generation = shared["generation"] + force
+    bucket = ttl_bucket(cache_ttl_seconds) + (generation,)
+    # fetched_at is stamped inside the cached fetcher, so a value stamped after
+    # this point came from upstream during this run rather than from the cache
+    run_started = time.monotonic()
+    with st.spinner("Fetching XAU and USD→INR..."):
+        try:
+            xau_usd, usd_inr, src_xau, fetched_at = fetch_xau(metals_api_key, bucket)
+            src_fx = src_xau
+            if usd_inr is None:
+                if blocked_for("exchangerate.host") > 0:
+                    raise RuntimeError("exchangerate.host is backing off")
+                usd_inr, src_fx, _ = call_source("exchangerate.host", fetch_usd_inr, generation)
+            result = (xau_usd, usd_inr, src_xau, src_fx, fetched_at)
+            with shared["lock"]:
+                shared["generation"] = max(shared["generation"], generation)
+                last = shared["last_good"]
+                if last is None or last[4] <= fetched_at:
+                    shared["last_good"] = result
+        except RateLimited as e:
+            st.error(f"Source error: 429. Retry after {e.retry_after}s.")
+        except Exception as e:
+            st.error(f"Fetch failed: {e}")
+            if not metals_api_key:
+                st.info("No Metals-API key configured. Add one in the sidebar to enable a paid fallback.")
+
+stale = result is None
+if stale:
+    result = shared["last_good"]
+if result is not None:
+    xau_usd, usd_inr, src_xau, src_fx, fetched_at = result
+    age = int(time.monotonic() - fetched_at)
+    if stale:
+        st.info(f"Showing last good price (age {age}s) until upstream can be reached again.")
+    elif fetched_at >= run_started:
+        st.success("Fetched live prices.")
+    else:
+        st.info(f"Showing cached price (age {age}s). Increase Cache TTL in sidebar to keep it longer.")
+    st.markdown(
+        f"XAU source: **{src_xau}**  |  USD→INR source: **{src_fx}**\n\n"
+        f"XAU (USD/oz): {xau_usd}\n\n"
+        f"USD → INR: {usd_inr}"
+    )
+    # show computed rates
+    show_rates(compute_rates(xau_usd, usd_inr, import_duty_pct, gst_pct, round_to))
 
 # show helpful tips
 st.markdown("---")
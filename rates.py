@@ -0,0 +1,24 @@
+# rates.py — price arithmetic for app.py, kept free of Streamlit so it can be tested
+GRAMS_PER_TROY_OUNCE = 31.1034768
+TEN_GRAMS_PER_OUNCE = 10.0 / GRAMS_PER_TROY_OUNCE  # USD/oz -> USD/10g
+PURITY_FACTORS = (("24K", 1.0), ("22K", 22/24), ("18K", 18/24))
+
+def round_value(x, step):
+    if step == 1.0:
+        # default step: whole rupees
+        return round(x)
+    if step <= 0:
+        return round(x, 2)
+    return round(round(x / step) * step, 2)
+
+# rows of (purity, base, after import duty, after GST) in ₹ per 10g
+def compute_rates(xau_usd, usd_inr, import_duty_pct, gst_pct, round_to):
+    inr_10g = xau_usd * usd_inr * TEN_GRAMS_PER_OUNCE
+    imp_mul = 1.0 + import_duty_pct/100.0
+    total_mul = imp_mul * (1.0 + gst_pct/100.0)
+    rows = []
+    for purity, factor in PURITY_FACTORS:
+        base = inr_10g * factor
+        rows.append((purity, round_value(base, round_to), round_value(base * imp_mul, round_to),
+                     round_value(base * total_mul, round_to)))
+    return rows
@@ -0,0 +1,51 @@
+from pathlib import Path
+
+import pytest
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+import upstream
+
+APP = str(Path(__file__).resolve().parent.parent / "app.py")
+
+
+@pytest.fixture
+def fake_upstream(monkeypatch):
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    calls = []
+    payloads = {}
+
+    def get_json(session, url, params):
+        host = url.split("/")[2]
+        calls.append(host)
+        return payloads[host]
+
+    monkeypatch.setattr(upstream, "get_json", get_json)
+    yield payloads, calls
+    st.cache_data.clear()
+    st.cache_resource.clear()
+
+
+def test_usd_inr_falls_back_to_exchangerate_host(fake_upstream):
+    payloads, calls = fake_upstream
+    payloads["query1.finance.yahoo.com"] = {"quoteResponse": {"result": [
+        {"symbol": "XAUUSD=X", "regularMarketPrice": 2400.0}]}}
+    payloads["api.exchangerate.host"] = {"quotes": {"USDINR": 83.0}}
+    at = AppTest.from_file(APP, default_timeout=30).run()
+    assert not at.exception
+    assert calls == ["query1.finance.yahoo.com", "api.exchangerate.host"]
+    summary = at.markdown[0].value
+    assert "USD→INR source: **exchangerate.host**" in summary
+    assert "USD → INR: 83.0" in summary
+
+
+def test_batched_usd_inr_skips_the_fallback(fake_upstream):
+    payloads, calls = fake_upstream
+    payloads["query1.finance.yahoo.com"] = {"quoteResponse": {"result": [
+        {"symbol": "INR=X", "regularMarketPrice": 83.0},
+        {"symbol": "XAUUSD=X", "regularMarketPrice": 2400.0}]}}
+    at = AppTest.from_file(APP, default_timeout=30).run()
+    assert not at.exception
+    assert calls == ["query1.finance.yahoo.com"]
+    assert "USD→INR source: **Yahoo Finance**" in at.markdown[0].value
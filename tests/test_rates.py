@@ -0,0 +1,35 @@
+import pytest
+
+from rates import GRAMS_PER_TROY_OUNCE, compute_rates, round_value
+
+
+@pytest.mark.parametrize("x, step, expected", [
+    (1234.5678, 1.0, 1235),
+    (1234.4, 1.0, 1234),
+    (1234.5678, 0, 1234.57),
+    (1234.5678, -5, 1234.57),
+    (1234.5678, 10, 1230.0),
+    (1234.5678, 0.5, 1234.5),
+])
+def test_round_value(x, step, expected):
+    assert round_value(x, step) == expected
+
+
+def test_round_value_whole_rupee_step_returns_int():
+    assert isinstance(round_value(1234.5678, 1.0), int)
+
+
+def test_compute_rates():
+    # one ounce at ₹ 1 per gram -> base 10.0 per 10g
+    rows = compute_rates(GRAMS_PER_TROY_OUNCE, 1.0, 10.0, 3.0, 0.01)
+    assert [r[0] for r in rows] == ["24K", "22K", "18K"]
+    purity, base, after_imp, final = rows[0]
+    assert (base, after_imp, final) == (10.0, 11.0, 11.33)
+    assert rows[1][1] == pytest.approx(10.0 * 22 / 24, abs=0.01)
+    assert rows[2][1] == 7.5
+
+
+def test_compute_rates_without_duty_or_gst():
+    rows = compute_rates(2400.0, 83.0, 0.0, 0.0, 1.0)
+    for _, base, after_imp, final in rows:
+        assert base == after_imp == final
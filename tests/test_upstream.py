@@ -0,0 +1,142 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from upstream import (MAX_JSON_BYTES, RateLimited, get_json, json_number, make_session,
+                      parse_exchangerate, parse_metals, parse_yahoo_quotes)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    status = 200
+    headers_out = {}
+    body = b"{}"
+    send_length = True
+    hits = 0
+
+    def do_GET(self):
+        type(self).hits += 1
+        self.send_response(self.status)
+        for k, v in self.headers_out.items():
+            self.send_header(k, v)
+        if self.send_length:
+            self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    handler = type("Handler", (_Handler,), {"hits": 0})
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    t = threading.Thread(target=httpd.serve_forever, daemon=True)
+    t.start()
+    yield handler, f"http://127.0.0.1:{httpd.server_port}/"
+    httpd.shutdown()
+
+
+@pytest.fixture
+def session():
+    s = make_session()
+    # route the local http:// test server through the production adapter/Retry
+    s.mount("http://", s.get_adapter("https://"))
+    return s
+
+
+def test_429_with_retry_after_is_not_retried(session):
+    retry = session.get_adapter("https://").max_retries
+    assert not retry.is_retry("GET", 429, has_retry_after=True)
+
+
+def test_429_surfaces_as_rate_limited(server, session):
+    handler, url = server
+    handler.status = 429
+    handler.headers_out = {"Retry-After": "30", "Content-Type": "text/html"}
+    started = time.monotonic()
+    with pytest.raises(RateLimited) as exc:
+        get_json(session, url, None)
+    assert exc.value.retry_after == 30
+    assert handler.hits == 1
+    assert time.monotonic() - started < 5
+
+
+def test_json_body_is_decoded(server, session):
+    handler, url = server
+    handler.headers_out = {"Content-Type": "application/json; charset=utf-8"}
+    handler.body = b'{"rates": {"INR": 83.1}}'
+    assert get_json(session, url, None) == {"rates": {"INR": 83.1}}
+
+
+def test_oversized_body_without_content_length_is_rejected(server, session):
+    handler, url = server
+    handler.headers_out = {"Content-Type": "application/json"}
+    handler.send_length = False
+    handler.body = b'{"pad": "' + b"x" * (MAX_JSON_BYTES * 2) + b'"}'
+    with pytest.raises(RuntimeError, match="too large"):
+        get_json(session, url, None)
+
+
+def _yahoo(*quotes):
+    return {"quoteResponse": {"result": [
+        {"symbol": sym, "regularMarketPrice": price} for sym, price in quotes]}}
+
+
+def test_yahoo_batch():
+    j = _yahoo(("XAUUSD=X", 2400.5), ("INR=X", 83.2))
+    assert parse_yahoo_quotes(j, "XAUUSD=X", "INR=X") == (2400.5, 83.2)
+
+
+def test_yahoo_batch_without_inr_leaves_rate_to_fallback():
+    j = _yahoo(("XAUUSD=X", 2400.5))
+    assert parse_yahoo_quotes(j, "XAUUSD=X", "INR=X") == (2400.5, None)
+
+
+def test_yahoo_batch_is_picked_by_symbol_not_position():
+    j = _yahoo(("INR=X", 83.2), ("XAUUSD=X", 2400.5))
+    assert parse_yahoo_quotes(j, "XAUUSD=X", "INR=X") == (2400.5, 83.2)
+
+
+@pytest.mark.parametrize("j", [
+    {},
+    {"quoteResponse": None},
+    {"quoteResponse": {"result": None}},
+    _yahoo(("INR=X", 83.2)),
+    [],
+])
+def test_yahoo_unexpected_shape(j):
+    with pytest.raises(RuntimeError, match="Yahoo Finance returned unexpected shape"):
+        parse_yahoo_quotes(j, "XAUUSD=X", "INR=X")
+
+
+@pytest.mark.parametrize("value", [True, False, "NaN", "inf", float("nan"), 0, -1.5, None, "abc"])
+def test_json_number_rejects_unusable_values(value):
+    with pytest.raises(RuntimeError, match="unexpected shape"):
+        json_number({"p": value}, [("p",)], "src")
+
+
+def test_json_number_falls_through_to_next_path():
+    assert json_number({"a": "NaN", "b": {"c": "83.5"}}, [("a",), ("b", "c")], "src") == 83.5
+
+
+def test_metals_rate_is_inverted():
+    price, rate = parse_metals({"rates": {"XAU": 0.0004, "INR": 83.2}}, "XAU", "INR")
+    assert price == pytest.approx(2500.0)
+    assert rate == 83.2
+
+
+def test_metals_without_inr():
+    assert parse_metals({"rates": {"XAU": 0.0005}}, "XAU", "INR") == (2000.0, None)
+
+
+def test_metals_zero_rate_is_rejected():
+    with pytest.raises(RuntimeError, match="Metals-API returned unexpected shape"):
+        parse_metals({"rates": {"XAU": 0, "INR": 83.2}}, "XAU", "INR")
+
+
+@pytest.mark.parametrize("j", [{"rates": {"INR": 83.2}}, {"quotes": {"USDINR": 83.2}}])
+def test_exchangerate_layouts(j):
+    assert parse_exchangerate(j, "USD", "INR") == 83.2
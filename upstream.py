@@ -0,0 +1,118 @@
+# upstream.py — HTTP plumbing for app.py, kept free of Streamlit so it can be tested
+from math import isfinite
+
+import requests
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+MAX_JSON_BYTES = 100_000  # quote payloads are a few KB; anything bigger is an error page
+REQUEST_TIMEOUT = (3.05, 5)  # (connect, read) seconds per attempt
+RETRIES = 1
+BACKOFF_FACTOR = 0.5
+# Worst case for one get_json: every attempt times out, plus the sleeps between
+# retries (urllib3 retries the first failure immediately). Callers waiting on a
+# fetch should use this, so they don't give up while the worker is still retrying.
+FETCH_BUDGET_SECONDS = ((RETRIES + 1) * sum(REQUEST_TIMEOUT)
+                        + sum(BACKOFF_FACTOR * 2 ** (n - 1) for n in range(2, RETRIES + 1)))
+
+# Transient 5xx / connection errors are retried with backoff by urllib3.
+# 429 is never retried: respect_retry_after_header=False stops urllib3 from
+# retrying (and sleeping on) any response that carries Retry-After, so the
+# hint comes straight back to check_response and on to the UI.
+def make_session():
+    retry = Retry(total=RETRIES, backoff_factor=BACKOFF_FACTOR, status_forcelist=[502, 503, 504],
+                  allowed_methods=["GET"], respect_retry_after_header=False,
+                  raise_on_status=False)
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry))
+    session.headers.update({
+        "User-Agent": "Mozilla/5.0 (gold-rate-calculator)",
+        "Accept": "application/json",
+    })
+    return session
+
+# raised when upstream answers 429; retry_after is its hint in seconds
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"429 — retry after {retry_after}s")
+        self.retry_after = retry_after
+
+# 429 -> RateLimited with the Retry-After hint, other HTTP errors -> HTTPError
+def check_response(resp):
+    if resp.status_code == 429:
+        ra = resp.headers.get("Retry-After")
+        try:
+            retry_after = int(float(ra))
+        except (TypeError, ValueError):
+            retry_after = 1
+        raise RateLimited(retry_after)
+    resp.raise_for_status()
+    return resp
+
+# GET and decode a JSON body. The response is streamed: an HTML rate-limit page
+# or an oversized Content-Length is rejected from the headers alone, and a
+# chunked/unlabelled body is read only up to MAX_JSON_BYTES before giving up.
+def get_json(session, url, params):
+    with session.get(url, params=params, timeout=REQUEST_TIMEOUT, stream=True) as resp:
+        check_response(resp)
+        ctype = resp.headers.get("Content-Type", "")
+        if not ctype.startswith("application/json"):
+            raise RuntimeError(f"non-JSON response ({ctype or 'no Content-Type'})")
+        if int(resp.headers.get("Content-Length") or 0) > MAX_JSON_BYTES:
+            raise RuntimeError("response too large")
+        body = bytearray()
+        for chunk in resp.iter_content(chunk_size=16384):
+            body += chunk
+            if len(body) > MAX_JSON_BYTES:
+                raise RuntimeError("response too large")
+        return orjson.loads(body)
+
+# Walk a decoded JSON body along the first candidate path that resolves to a
+# usable price: a finite number above zero. Booleans and "NaN"/"inf" strings
+# don't count. Each provider lists its known shapes; add one here when it changes.
+def json_number(j, paths, source):
+    for path in paths:
+        cur = j
+        try:
+            for key in path:
+                cur = cur[key]
+            if isinstance(cur, bool):
+                continue
+            value = float(cur)
+        except (KeyError, IndexError, TypeError, ValueError):
+            continue
+        if isfinite(value) and value > 0:
+            return value
+    raise RuntimeError(f"{source} returned unexpected shape")
+
+# Provider payloads -> numbers. The XAU parsers return (xau_usd, usd_inr or
+# None): USD→INR rides along in the same request but is optional, the caller
+# falls back to exchangerate.host when it is missing.
+
+# Yahoo v7 quote batch; quotes are picked by symbol, not by position
+def parse_yahoo_quotes(j, xau_symbol, fx_symbol):
+    try:
+        results = j["quoteResponse"]["result"] or []
+    except (KeyError, TypeError):
+        results = []
+    quotes = {q.get("symbol"): q for q in results if isinstance(q, dict)}
+    price = json_number(quotes, [(xau_symbol, "regularMarketPrice")], "Yahoo Finance")
+    try:
+        rate = json_number(quotes, [(fx_symbol, "regularMarketPrice")], "Yahoo Finance")
+    except RuntimeError:
+        rate = None
+    return price, rate
+
+# Metals-API with base=USD quotes ounces per dollar; invert to USD/oz
+def parse_metals(j, symbol, fx_symbol):
+    r = json_number(j, [("rates", symbol)], "Metals-API")
+    try:
+        rate = json_number(j, [("rates", fx_symbol)], "Metals-API")
+    except RuntimeError:
+        rate = None
+    return 1.0 / r, rate
+
+# exchangerate.host has served both a "rates" and an older "quotes" layout
+def parse_exchangerate(j, base, symbol):
+    return json_number(j, [("rates", symbol), ("quotes", base + symbol)], "exchangerate.host")